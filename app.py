@@ -1,114 +1,264 @@
 import os
-import json
 import datetime
+import time
 import sys
+import atexit
+import hashlib
+import sqlite3
+import threading
+import queue
+import gzip
 import re
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
-from flask_cors import CORS
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, Response, request, jsonify, redirect
+from quart_cors import cors
 from google import genai
 from google.genai import types
-import PyPDF2
+import pypdfium2 as pdfium
+from cachetools import TTLCache
+import orjson
+import httpx
 
 import config
 
-app = Flask(__name__)
-CORS(app)
+app = Quart(__name__)
+app = cors(app)
 
 # --- CONFIGURATION ---
-client = genai.Client(api_key=config.GEMINI_KEY)
+# One client (and one pooled, keep-alive HTTP connection set) shared by every request
+GEMINI_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+client = genai.Client(
+    api_key=config.GEMINI_KEY,
+    http_options=types.HttpOptions(
+        client_args={"limits": GEMINI_HTTP_LIMITS},
+        async_client_args={"limits": GEMINI_HTTP_LIMITS}
+    )
+)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-LOG_FILE = os.path.join(BASE_DIR, "chat_history.json")
-RESULT_FILE = os.path.join(BASE_DIR, "interviews.json")
+# Only this much resume text is ever sent to Gemini, so extraction stops once it is reached
+RESUME_TEXT_LIMIT = 4000
+CHAT_DB = os.path.join(BASE_DIR, "chat.db")
+RESULT_FILE = os.path.join(BASE_DIR, "interviews.jsonl")
 
 # --- GLOBAL STORAGE ---
+# Session state is held in TTL caches so abandoned interviews are evicted instead of
+# accumulating for the life of the process. They are only touched from the event loop
+# (the PDF pool and the writer thread never see them), so no lock is needed.
 # Store structured candidate data here to pass to the UI
-active_candidates = {} 
-# Store active chat sessions (Gemini objects)
-active_chats = {} 
+active_candidates = TTLCache(maxsize=1000, ttl=3600)
+# Store active chat sessions (Gemini objects); the TTL is refreshed on every turn
+active_chats = TTLCache(maxsize=1000, ttl=3600)
+# Parsed resumes keyed by a hash of the extracted text (skips repeat Gemini calls)
+_resume_cache = TTLCache(maxsize=512, ttl=3600)
+# Background resume parsing jobs (job_id -> asyncio.Task) and the pool for PDF extraction.
+# PDFium is not thread-safe (not even across documents), so extraction runs on a single
+# thread: off the event loop, but never two PDFium calls at once.
+resume_jobs = TTLCache(maxsize=1000, ttl=600)
+# Strong references to running jobs: asyncio only keeps weak ones, and resume_jobs may evict
+_running_jobs = set()
+pdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdfium")
+# Per-session asyncio locks that serialize chat turns
+chat_locks = TTLCache(maxsize=1000, ttl=3600)
+# Sessions whose interview was submitted; late turns get a canned reply instead of a new chat
+finished_sessions = TTLCache(maxsize=1000, ttl=3600)
+# Buffered chat log records per session, flushed when the session ends (or is evicted)
+class _LogBufferCache(TTLCache):
+    """TTLCache whose evicted or expired buffers are written to the chat database rather than dropped."""
+    def popitem(self):
+        key, buffer = super().popitem()
+        submit_write(write_log_records, buffer)
+        return key, buffer
 
-print(f"\n📂 LOGGING TO:\n  -> {LOG_FILE}\n  -> {RESULT_FILE}\n")
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, buffer in expired: submit_write(write_log_records, buffer)
+        return expired
+
+active_logs = _LogBufferCache(maxsize=1000, ttl=3600)
+
+# --- JSON HELPERS (orjson; bytes in, bytes out) ---
+def json_dumps(obj):
+    return orjson.dumps(obj)
+
+def json_loads(data):
+    return orjson.loads(data)
+
+print(f"\n📂 LOGGING TO:\n  -> {CHAT_DB}\n  -> {RESULT_FILE}\n")
 
 # --- INITIALIZATION ---
+# Chat history lives in SQLite (WAL mode): concurrent appends and indexed session lookups
+chat_db = sqlite3.connect(CHAT_DB, isolation_level=None, check_same_thread=False)
+chat_db_lock = threading.Lock()
+
 def init_files():
     try:
-        if not os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "w", encoding='utf-8') as f: json.dump([], f)
+        chat_db.execute("PRAGMA journal_mode=WAL")
+        chat_db.execute("PRAGMA synchronous=NORMAL")
+        chat_db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, ts TEXT NOT NULL, role TEXT NOT NULL, message TEXT)")
+        chat_db.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id)")
         if not os.path.exists(RESULT_FILE):
-            with open(RESULT_FILE, "w", encoding='utf-8') as f: json.dump([], f)
+            open(RESULT_FILE, "wb").close()
     except Exception as e:
         print(f"❌ CRITICAL ERROR: Cannot write to files.\nError: {e}")
 
 init_files()
 
 # --- HELPER: EXTRACT INFO USING GEMINI ---
-def parse_resume_with_ai(text):
+# Static instructions go in the system instruction so every request shares the same prefix
+RESUME_EXTRACTION_PROMPT = """
+Analyze the resume text sent by the user and extract the candidate's details.
+
+Keys required:
+- name (String, Title Case)
+- email (String)
+- skills (String, comma separated list of top 5 technical skills)
+- summary (String, a brief 2-sentence professional summary)
+- projects (String, a string where every project starts with the character "•" and is separated by a newline)
+"""
+
+# Structured output: Gemini returns exactly these keys, already typed
+RESUME_SCHEMA = types.Schema(
+    type="OBJECT",
+    properties={key: types.Schema(type="STRING") for key in ("name", "email", "skills", "summary", "projects")},
+    required=["name", "email", "skills", "summary", "projects"]
+)
+
+# Returned when the resume can't be parsed (unreadable text or an AI failure)
+FALLBACK_DATA = {
+    "name": "Candidate", 
+    "email": "Unknown", 
+    "skills": "General", 
+    "summary": "Could not parse resume.",
+    "projects": "N/A"
+}
+# Cheap checks that the extracted text is worth a Gemini call
+_WORD_RE = re.compile(r"[A-Za-z]{4,}")
+MIN_PRINTABLE_RATIO = 0.85
+
+def looks_like_resume_text(text):
+    """Rejects empty, image-only or garbled extractions before they reach Gemini."""
+    sample = text[:RESUME_TEXT_LIMIT]
+    if len(sample.strip()) < 50 or not _WORD_RE.search(sample): return False
+    printable = sum(1 for ch in sample if ch.isprintable() or ch.isspace())
+    return printable / len(sample) >= MIN_PRINTABLE_RATIO
+
+async def parse_resume_with_ai(text):
     """Sends resume text to Gemini to extract structured JSON data."""
+    if not looks_like_resume_text(text): return dict(FALLBACK_DATA)
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    cached = _resume_cache.get(key)
+    if cached is not None: return cached
     try:
-        prompt = f"""
-        Analyze the following resume text and extract the candidate's details.
-        Return ONLY a raw JSON object (no markdown formatting).
-        
-        Keys required:
-        - name (String, Title Case)
-        - email (String)
-        - skills (String, comma separated list of top 5 technical skills)
-        - summary (String, a brief 2-sentence professional summary)
-        - projects (String, a string where every project starts with the character "•" and is separated by a newline)
-
-        RESUME TEXT:
-        {text[:4000]}
-        """
-        
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-2.0-flash-exp", 
-            contents=prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json")
+            contents=text[:RESUME_TEXT_LIMIT],
+            config=types.GenerateContentConfig(
+                system_instruction=RESUME_EXTRACTION_PROMPT,
+                response_mime_type="application/json",
+                response_schema=RESUME_SCHEMA,
+                max_output_tokens=400
+            )
         )
         
-        return json.loads(response.text)
+        parsed = json_loads(response.text)
+        _resume_cache[key] = parsed
+        return parsed
     except Exception as e:
         print(f"AI Extraction Error: {e}")
         # Fallback data if AI fails
-        return {
-            "name": "Candidate", 
-            "email": "Unknown", 
-            "skills": "General", 
-            "summary": "Could not parse resume.",
-            "projects": "N/A"
-        }
+        return dict(FALLBACK_DATA)
+
+# --- HELPER: PDF TEXT EXTRACTION ---
+def extract_pdf_text(data):
+    """Extracts page text with PDFium, stopping once RESUME_TEXT_LIMIT characters are collected."""
+    pdf = pdfium.PdfDocument(data)
+    pages, length = [], 0
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close(); page.close()
+            length += len(pages[-1]) + 1
+            if length >= RESUME_TEXT_LIMIT: break
+    finally:
+        pdf.close()
+    return "\n".join(pages)
+
+# --- BACKGROUND WRITER ---
+# Disk writes (chat log inserts, result appends) run on one daemon thread, off the request path
+_write_queue = queue.Queue()
+
+def _writer_loop():
+    while True:
+        fn, args = _write_queue.get()
+        try: fn(*args)
+        except Exception as e: print(f"❌ BACKGROUND WRITE FAILED: {e}")
+        finally: _write_queue.task_done()
+
+threading.Thread(target=_writer_loop, name="log-writer", daemon=True).start()
+
+def submit_write(fn, *args):
+    _write_queue.put((fn, args))
 
 # --- LOGGING ---
+# Last formatted second, so bursts of log calls reuse one timestamp string
+_ts_cache = [None, ""]
+
+def fast_iso():
+    """UTC ISO-8601 timestamp (second precision), formatted at most once per second."""
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[:] = [now, datetime.datetime.fromtimestamp(now, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")]
+    return _ts_cache[1]
+
 def log_interaction(session_id, user_msg, ai_msg):
-    try:
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "r", encoding='utf-8') as f:
-                try: logs = json.load(f)
-                except: logs = []
-        else: logs = []
-
-        session = next((s for s in logs if s.get("sessionId") == session_id), None)
-        if not session:
-            session = { "sessionId": session_id, "timestamp": datetime.datetime.now().isoformat(), "conversation": [] }
-            logs.append(session)
-        
-        session["conversation"].append({"role": "Candidate", "message": user_msg})
-        session["conversation"].append({"role": "Divya", "message": ai_msg})
+    """Buffers the turn in memory; it is written out by flush_session_log()."""
+    ts = fast_iso()
+    buffer = active_logs.setdefault(session_id, [])
+    buffer.append((session_id, ts, "Candidate", user_msg))
+    buffer.append((session_id, ts, "Divya", ai_msg))
 
-        with open(LOG_FILE, "w", encoding='utf-8') as f: json.dump(logs, f, indent=2) 
+def write_log_records(buffer):
+    """Inserts buffered (session_id, ts, role, message) rows in one transaction."""
+    if not buffer: return
+    try:
+        with chat_db_lock:
+            chat_db.execute("BEGIN")
+            try:
+                chat_db.executemany("INSERT INTO messages (session_id, ts, role, message) VALUES (?, ?, ?, ?)", buffer)
+                chat_db.execute("COMMIT")
+            except Exception:
+                chat_db.execute("ROLLBACK")
+                raise
     except Exception as e:
         print(f"❌ LOGGING FAILED: {e}")
 
+def flush_session_log(session_id):
+    buffer = active_logs.pop(session_id, None)
+    if buffer: submit_write(write_log_records, buffer)
+
+@atexit.register
+def flush_all_logs():
+    active_logs.expire()
+    for session_id in list(active_logs):
+        flush_session_log(session_id)
+    _write_queue.join()
+
 def save_result(candidate, score, feedback, cheated=False):
+    """Queues one result record for the JSONL results file."""
+    submit_write(write_result, {
+        "timestamp": fast_iso(),
+        "candidate": candidate,
+        "score": 0 if cheated else score,
+        "feedback": "DISQUALIFIED (Cheating)" if cheated else feedback,
+        "cheated": cheated
+    })
+
+def write_result(record):
     try:
-        results = json.load(open(RESULT_FILE)) if os.path.exists(RESULT_FILE) else []
-        results.append({
-            "timestamp": datetime.datetime.now().isoformat(),
-            "candidate": candidate,
-            "score": 0 if cheated else score,
-            "feedback": "DISQUALIFIED (Cheating)" if cheated else feedback,
-            "cheated": cheated
-        })
-        with open(RESULT_FILE, "w", encoding='utf-8') as f: json.dump(results, f, indent=2)
+        with open(RESULT_FILE, "ab") as f: f.write(json_dumps(record) + b"\n")
         print("🏆 Interview Result Saved!")
     except Exception as e:
         print(f"❌ RESULT SAVE FAILED: {e}")
@@ -121,6 +271,8 @@ HTML_TEMPLATE = r"""
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
     <title>Canary Digital.ai | Interview</title>
+    <link rel="preconnect" href="https://cdn.tailwindcss.com">
+    <link rel="preconnect" href="https://cdnjs.cloudflare.com" crossorigin>
     <script src="https://cdn.tailwindcss.com"></script>
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
     <style>
@@ -379,9 +531,14 @@ HTML_TEMPLATE = r"""
         const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
         const recognition = new SpeechRecognition(); recognition.continuous = false; recognition.lang = 'en-IN'; recognition.interimResults = true;
 
-        let availableVoices = [];
-        window.speechSynthesis.onvoiceschanged = () => { availableVoices = window.speechSynthesis.getVoices(); };
-        window.speechSynthesis.getVoices(); 
+        // Voice is picked once when the list loads, not on every utterance
+        let availableVoices = [], cachedVoice = null;
+        function loadVoices() {
+            availableVoices = window.speechSynthesis.getVoices();
+            cachedVoice = availableVoices.find(v => v.name.includes('Zira') || v.name.includes('Samantha') || v.name.includes('Female')) || null;
+        }
+        window.speechSynthesis.onvoiceschanged = loadVoices;
+        loadVoices();
 
         const dropZone = document.getElementById('dropZone');
         const fileInput = document.getElementById('resumeFile');
@@ -430,7 +587,12 @@ HTML_TEMPLATE = r"""
 
             try {
                 const res = await fetch('/upload_resume', { method: 'POST', body: formData });
-                const data = await res.json();
+                let data = await res.json();
+                // Parsing runs in the background; poll until the job finishes
+                while (data.status === "pending") {
+                    await new Promise(r => setTimeout(r, 500));
+                    data = await (await fetch(`/resume_status/${data.job_id}`)).json();
+                }
                 
                 if (data.status === "success") {
                     const c = data.candidate;
@@ -443,6 +605,7 @@ HTML_TEMPLATE = r"""
                     btn.innerText = "Enter Interview Room";
                     btn.onclick = () => startRealInterview();
                     btn.disabled = false;
+                    warmUpSpeech();
                 } else {
                     errorMsg.innerText = "❌ " + data.message;
                     errorMsg.classList.remove('hidden');
@@ -455,6 +618,16 @@ HTML_TEMPLATE = r"""
             }
         }
 
+        // Spin up TTS/STT while the candidate is still on the popup, so the first
+        // greeting and the first "Listening..." don't pay the browser's cold start
+        function warmUpSpeech() {
+            loadVoices();
+            const warmUtter = new SpeechSynthesisUtterance(' ');
+            warmUtter.volume = 0;
+            window.speechSynthesis.speak(warmUtter);
+            try { recognition.start(); recognition.stop(); } catch(e) {}
+        }
+
         function startRealInterview() {
             const elem = document.documentElement;
             if (elem.requestFullscreen) { elem.requestFullscreen().catch(() => {}); } 
@@ -498,6 +671,8 @@ HTML_TEMPLATE = r"""
             isSessionActive = false;
             recognition.stop();
             stopSilenceTimer();
+            clearPendingFinal();
+            stopSpeaking();
             mainIcon.className = "fas fa-ban";
             mainBtn.className = "w-16 h-16 md:w-20 md:h-20 rounded-full bg-red-600 text-white shadow-lg flex items-center justify-center cursor-not-allowed";
             statusText.innerText = "Terminated";
@@ -514,8 +689,9 @@ HTML_TEMPLATE = r"""
             if (isDisqualified) return;
             isSessionActive = false;
             stopSilenceTimer();
+            clearPendingFinal();
             recognition.stop();
-            window.speechSynthesis.cancel();
+            stopSpeaking();
             
             mainIcon.className = "fas fa-microphone";
             mainBtn.classList.remove("animate-pulse");
@@ -592,159 +768,317 @@ HTML_TEMPLATE = r"""
         
         recognition.onstart=()=>{ if(isSessionActive) statusText.innerText="Listening..."; };
         recognition.onend=()=>{ if(isSessionActive && !isProcessing && !isDisqualified) try{recognition.start();}catch(e){} };
-        recognition.onresult=(e)=>{ const t=e.results[0][0].transcript; liveTranscript.innerText=t; stopSilenceTimer(); if(e.results[0].isFinal) handleUserMessage(t); };
+        // Finals that arrive within FINAL_DEBOUNCE_MS of each other ("...actually, also X") are sent as one turn.
+        // The timer survives the automatic restart in onend on purpose; it is dropped when the interview stops.
+        const FINAL_DEBOUNCE_MS = 400;
+        let pendingFinal = [], finalTimer = null;
+        function clearPendingFinal() { clearTimeout(finalTimer); pendingFinal = []; }
+        recognition.onresult=(e)=>{
+            const t=e.results[0][0].transcript; liveTranscript.innerText=t; stopSilenceTimer();
+            if (!e.results[0].isFinal) return;
+            pendingFinal.push(t); clearTimeout(finalTimer);
+            finalTimer = setTimeout(() => { const combined = pendingFinal.join(' '); pendingFinal = []; if (isSessionActive) handleUserMessage(combined); }, FINAL_DEBOUNCE_MS);
+        };
         
         async function handleUserMessage(text) {
             stopSilenceTimer();
             silenceWarningCount = 0; 
             recognition.stop(); isProcessing=true; statusText.innerText="Thinking..."; addMessage('Candidate',text);
+            stopSpeaking(); // the candidate interrupted; drop whatever Divya was still saying
             try {
                 const res = await fetch('/process_chat', { method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({session_id:sessionId, message:text}) });
-                const data = await res.json(); addMessage('Divya', data.reply);
+                // Speak each sentence as it streams in; the last event carries the full reply
+                let spokenChunks = 0;
+                const data = await readEventStream(res, (evt) => { spokenChunks++; enqueueSentence(evt.chunk); });
+                addMessage('Divya', data.reply);
                 if(data.finished) { 
                     statusText.innerText="Finished"; mainIcon.className="fas fa-check"; mainBtn.classList.remove("animate-pulse"); speak(data.reply, true); 
-                } else { speak(data.reply, false); }
+                } else if (spokenChunks === 0) { speak(data.reply, false); }
+                else if (window.speechSynthesis.speaking || window.speechSynthesis.pending) { handOffMicAfter(lastUtterance); }
+                else { afterSpeech(false); }
             } catch(e) { console.error(e); statusText.innerText="Error"; } finally { isProcessing=false; }
         }
-        
-        function speak(text, isFinal = false) {
-            window.speechSynthesis.cancel(); 
+
+        // Reads a text/event-stream response: calls onChunk for {chunk} events, resolves with the final event
+        async function readEventStream(res, onChunk) {
+            const reader = res.body.getReader(), decoder = new TextDecoder();
+            let buffer = "", result = null;
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let end;
+                while ((end = buffer.indexOf("\n\n")) >= 0) {
+                    const line = buffer.slice(0, end); buffer = buffer.slice(end + 2);
+                    if (!line.startsWith("data: ")) continue;
+                    const evt = JSON.parse(line.slice(6));
+                    if (evt.chunk !== undefined) onChunk(evt); else result = evt;
+                }
+            }
+            if (!result) throw new Error("Reply stream ended early");
+            return result;
+        }
+
+        function makeUtterance(text) {
             const u = new SpeechSynthesisUtterance(text);
-            if (availableVoices.length === 0) availableVoices = window.speechSynthesis.getVoices();
-            const femaleVoice = availableVoices.find(v => v.name.includes('Zira') || v.name.includes('Samantha') || v.name.includes('Female'));
-            if (femaleVoice) u.voice = femaleVoice;
-            u.onend = () => {
-                if (isFinal) setTimeout(resetToPopup, 1000); 
-                else if (isSessionActive && !isDisqualified) { try { recognition.start(); } catch(e) {} startSilenceTimer(); }
+            if (availableVoices.length === 0) loadVoices(); // browsers that never fire voiceschanged
+            if (cachedVoice) u.voice = cachedVoice;
+            return u;
+        }
+
+        // cancel() on an idle queue still round-trips to the speech service on some platforms
+        function stopSpeaking() {
+            if (window.speechSynthesis.speaking || window.speechSynthesis.pending) window.speechSynthesis.cancel();
+        }
+
+        function afterSpeech(isFinal) {
+            if (isFinal) setTimeout(resetToPopup, 1000); 
+            else if (isSessionActive && !isDisqualified) { try { recognition.start(); } catch(e) {} startSilenceTimer(); }
+        }
+
+        // Opens the mic during the last stretch of an utterance (via boundary events) so it is
+        // already listening when Divya stops; onend still covers voices without boundary events.
+        const MIC_PREARM_RATIO = 0.9;
+        function handOffMicAfter(u) {
+            let armed = false;
+            const arm = () => {
+                if (armed) return;
+                armed = true;
+                if (isSessionActive && !isDisqualified && !isProcessing) try { recognition.start(); } catch(e) {}
             };
-            window.speechSynthesis.speak(u);
+            u.onboundary = (ev) => { if (ev.charIndex / u.text.length >= MIC_PREARM_RATIO) arm(); };
+            u.onend = () => { arm(); if (isSessionActive && !isDisqualified && !isProcessing) startSilenceTimer(); };
+        }
+
+        // Queues a sentence behind whatever is already speaking; the browser's speech queue keeps
+        // the order, so streamed sentences play back to back. Only an interruption cancels.
+        let lastUtterance = null;
+        function enqueueSentence(text) {
+            lastUtterance = makeUtterance(text);
+            window.speechSynthesis.speak(lastUtterance);
+            return lastUtterance;
+        }
+        
+        function speak(text, isFinal = false) {
+            const u = enqueueSentence(text);
+            if (isFinal) u.onend = () => afterSpeech(true);
+            else handOffMicAfter(u);
         }
     </script>
 </body>
 </html>
 """
 
+# The template only needs the logo URL, so bake it in once instead of rendering per request
+CANARY_URL = "/static/canary.png"
+INDEX_HTML = HTML_TEMPLATE.replace("{{ url_for('static', filename='canary.png') }}", CANARY_URL)
+# Encoded and gzipped once at import; the ETag lets browsers revalidate with a 304
+INDEX_HTML_BYTES = INDEX_HTML.encode('utf-8')
+INDEX_HTML_GZ = gzip.compress(INDEX_HTML_BYTES, compresslevel=9)
+INDEX_ETAG = 'W/"' + hashlib.blake2b(INDEX_HTML_BYTES, digest_size=16).hexdigest() + '"'
+
 # --- BACKEND LOGIC ---
 submit_tool = types.Tool(function_declarations=[types.FunctionDeclaration(name="submit_interview", description="Submit score", parameters=types.Schema(type="OBJECT", properties={"candidate_name": types.Schema(type="STRING"), "score": types.Schema(type="NUMBER"), "feedback": types.Schema(type="STRING")}, required=["candidate_name", "score", "feedback"]))])
 
+# Identical for every session (so Gemini can reuse the prefix); only the candidate tail varies
+STATIC_SYS_PROMPT = """
+SYSTEM: You are Divya, a professional Tech Recruiter at Canary Digital.ai, interviewing a candidate for the AI Engineer role.
+
+*** STRICT INTERVIEW FLOW (FOLLOW EXACTLY) ***
+1. Ask ONLY ONE question at a time.
+2. Wait for the candidate's answer before moving on.
+3. If the answer is unclear, ask for clarification.
+4. NEVER deviate from the question flow below.
+
+INTERVIEW QUESTION FLOW:
+Step 1: The candidate has already been greeted. Do NOT say "Hello" again.
+        IMMEDIATELY ask 1 specific question about a PROJECT listed in their resume.
+Step 2: (After they answer) Ask a TECHNICAL question about a core SKILL listed in their resume.
+Step 3: (After they answer) Ask a second, slightly harder TECHNICAL question relevant to the role.
+Step 4: (After they answer) Ask a third and final TECHNICAL question (scenario-based or problem-solving).
+Step 5: (After they answer) Do NOT ask any more questions. IMMEDIATELY call the function 'submit_interview' to save their score (0-10) and feedback.
+
+CRITERIA FOR SCORING:
+- Did they answer clearly?
+- Was the technical detail correct?
+- Assign a score from 1 to 10 based on these answers.
+"""
+
+# Turns are one short question; the cap still leaves room for submit_interview's feedback
+INTERVIEW_MAX_OUTPUT_TOKENS = 256
+# Opening model turn shared by every chat; each session gets its own list, the Content is reused
+_INIT_HISTORY = (types.Content(role="model", parts=[types.Part(text="Ready.")]),)
+
 def get_chat_session(session_id):
-    if session_id not in active_chats:
-        # Default values
-        cand_name = "Candidate"
-        resume_text = "No resume provided."
-        
-        # Load Resume Data if available
-        if session_id in active_candidates:
-            c = active_candidates[session_id]
-            cand_name = c.get('name', 'Candidate')
-            resume_text = c.get('text', '')[:2000] # Limit text to avoid token limits
-
-        # --- UPDATED STRICT INSTRUCTIONS (Fixes Double Greeting) ---
-        sys_prompt = f"""
-        SYSTEM: You are Divya, a professional Tech Recruiter at Canary Digital.ai.
-        You are interviewing {cand_name} for the AI Engineer role.
-        Resume: "{resume_text}..."
-
-        *** STRICT INTERVIEW FLOW (FOLLOW EXACTLY) ***
-        1. Ask ONLY ONE question at a time.
-        2. Wait for the candidate's answer before moving on.
-        3. If the answer is unclear, ask for clarification.
-        4. NEVER deviate from the question flow below.
-
-        INTERVIEW QUESTION FLOW:
-        Step 1: The candidate has already been greeted. Do NOT say "Hello" again.
-                IMMEDIATELY ask 1 specific question about a PROJECT listed in their resume.
-        Step 2: (After they answer) Ask a TECHNICAL question about a core SKILL listed in their resume.
-        Step 3: (After they answer) Ask a second, slightly harder TECHNICAL question relevant to the role.
-        Step 4: (After they answer) Ask a third and final TECHNICAL question (scenario-based or problem-solving).
-        Step 5: (After they answer) Do NOT ask any more questions. IMMEDIATELY call the function 'submit_interview' to save their score (0-10) and feedback.
-        
-        CRITERIA FOR SCORING:
-        - Did they answer clearly?
-        - Was the technical detail correct?
-        - Assign a score from 1 to 10 based on these answers.
-        """
+    chat = active_chats.get(session_id)
+    if chat is None:
+        # Structured fields from parse_resume_with_ai stand in for the raw resume text
+        c = active_candidates.get(session_id) or {}
+        sys_prompt = STATIC_SYS_PROMPT + (
+            f"\nCandidate: {c.get('name', 'Candidate')}"
+            f"\nSkills: {c.get('skills', 'N/A')}"
+            f"\nProjects: {c.get('projects', 'N/A')}"
+            f"\nSummary: {c.get('summary', 'No resume provided.')}\n"
+        )
         
-        active_chats[session_id] = client.chats.create(
+        chat = client.aio.chats.create(
             model="gemini-2.0-flash-exp", 
             config=types.GenerateContentConfig(
                 tools=[submit_tool], 
-                system_instruction=sys_prompt
+                system_instruction=sys_prompt,
+                max_output_tokens=INTERVIEW_MAX_OUTPUT_TOKENS,
+                temperature=0.4,
+                candidate_count=1,
+                stop_sequences=["\nCandidate:"]
             ), 
-            history=[types.Content(role="model", parts=[types.Part(text="Ready.")])]
+            history=list(_INIT_HISTORY)
         )
-    return active_chats[session_id]
+    # Re-inserting refreshes the TTL, so only idle sessions expire
+    active_chats[session_id] = chat
+    return chat
 
-# --- ROUTES ---
-@app.route('/')
-def index(): return render_template_string(HTML_TEMPLATE)
+def get_chat_lock(session_id):
+    lock = chat_locks.get(session_id)
+    if lock is None: lock = chat_locks[session_id] = asyncio.Lock()
+    return lock
 
-@app.route('/index.html')
-def index_redirect(): return redirect('/')
-
-@app.route('/upload_resume', methods=['POST'])
-def upload_resume():
+async def process_resume(data, session_id):
+    """Background job behind /upload_resume: PDF extraction in the pool, then Gemini parsing."""
     try:
-        if 'file' not in request.files: return jsonify({"status": "error", "message": "No file"})
-        file = request.files['file']
-        session_id = request.form.get("session_id")
-        
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
+        text = await asyncio.get_running_loop().run_in_executor(pdf_executor, extract_pdf_text, data)
             
         if len(text) < 50:
-            return jsonify({"status": "error", "message": "File is empty or unreadable."})
+            return {"status": "error", "message": "File is empty or unreadable."}
 
         # EXTRACT INFO WITH AI
-        parsed_data = parse_resume_with_ai(text)
+        parsed_data = await parse_resume_with_ai(text)
         
-        # Store structured data + full text
-        active_candidates[session_id] = {
-            "name": parsed_data.get("name", "Candidate"),
-            "email": parsed_data.get("email", "N/A"),
-            "skills": parsed_data.get("skills", "N/A"),
-            "summary": parsed_data.get("summary", "N/A"),
-            "projects": parsed_data.get("projects", "N/A"),
-            "text": text
+        # Store structured data only; the raw text isn't needed once parsed (and isn't sent back to the browser)
+        # The response schema (and FALLBACK_DATA) guarantee every key is present
+        candidate = active_candidates[session_id] = {
+            "name": parsed_data["name"],
+            "email": parsed_data["email"],
+            "skills": parsed_data["skills"],
+            "summary": parsed_data["summary"],
+            "projects": parsed_data["projects"]
         }
         
-        print(f"✅ Parsed Resume for: {active_candidates[session_id]['name']}")
+        print(f"✅ Parsed Resume for: {candidate['name']}")
+
+        # Build the chat now (replacing any from an earlier upload) so the first turn finds it ready;
+        # a new resume in the same tab also starts a new interview, so forget that the last one finished
+        active_chats.pop(session_id, None)
+        finished_sessions.pop(session_id, None)
+        get_chat_session(session_id)
+        
+        return {"status": "success", "candidate": candidate}
+        
+    except Exception as e:
+        print(f"Upload Error: {e}")
+        return {"status": "error", "message": "Could not process file."}
+
+# Splits streamed model text after sentence-ending punctuation
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+def sse_event(payload):
+    return b"data: " + json_dumps(payload) + b"\n\n"
+
+# --- ROUTES ---
+@app.route('/')
+async def index():
+    headers = {"ETag": INDEX_ETAG, "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+    if INDEX_ETAG in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(INDEX_HTML_GZ, mimetype="text/html", headers=headers)
+    return Response(INDEX_HTML_BYTES, mimetype="text/html", headers=headers)
+
+@app.route('/index.html')
+async def index_redirect(): return redirect('/')
+
+@app.route('/upload_resume', methods=['POST'])
+async def upload_resume():
+    try:
+        files = await request.files
+        if 'file' not in files: return jsonify({"status": "error", "message": "No file"})
+        file = files['file']
+        session_id = (await request.form).get("session_id")
         
-        return jsonify({
-            "status": "success", 
-            "candidate": active_candidates[session_id]
-        })
+        # Parse in the background; the browser polls /resume_status/<job_id>
+        job_id = uuid.uuid4().hex
+        task = resume_jobs[job_id] = asyncio.create_task(process_resume(file.read(), session_id))
+        _running_jobs.add(task)
+        task.add_done_callback(_running_jobs.discard)
+        return jsonify({"status": "pending", "job_id": job_id}), 202
         
     except Exception as e:
         print(f"Upload Error: {e}")
         return jsonify({"status": "error", "message": "Could not process file."})
 
+@app.route('/resume_status/<job_id>')
+async def resume_status(job_id):
+    job = resume_jobs.get(job_id)
+    if job is None: return jsonify({"status": "error", "message": "Unknown upload."}), 404
+    if not job.done(): return jsonify({"status": "pending", "job_id": job_id}), 202
+    resume_jobs.pop(job_id, None)
+    return jsonify(job.result())
+
 @app.route('/disqualify', methods=['POST'])
-def disqualify_candidate():
+async def disqualify_candidate():
+    data = await request.get_json(silent=True) or {}
+    flush_session_log(data.get("session_id"))
     save_result("Candidate (Disqualified)", 0, "Terminated for cheating", cheated=True)
     return jsonify({"status": "disqualified"})
 
 @app.route('/process_chat', methods=['POST'])
-def process_chat():
-    data = request.json
-    chat = get_chat_session(data.get("session_id"))
-    response = chat.send_message(data.get("message"))
-    ai_text, is_finished = "", False
-    
-    if response.candidates and response.candidates[0].content.parts:
-        for part in response.candidates[0].content.parts:
-            if part.function_call:
-                args = part.function_call.args
-                score = args.get('score'); feedback = args.get('feedback'); candidate = args.get('candidate_name')
-                save_result(candidate, score, feedback)
-                ai_text = f"Interview Complete. Score: {score}/10. {feedback}"; is_finished = True
-                if data.get("session_id") in active_chats: del active_chats[data.get("session_id")]
-            elif part.text: ai_text += part.text
-            
-    log_interaction(data.get("session_id"), data.get("message"), ai_text.replace("**", "").strip())
-    return jsonify({"reply": ai_text.replace("**", "").strip(), "finished": is_finished})
+async def process_chat():
+    data = await request.get_json()
+    session_id, message = data.get("session_id"), data.get("message")
+
+    # Streams the reply as Server-Sent Events: one {"chunk"} per complete sentence so the
+    # browser can start speaking early, then a final {"reply", "finished"} event.
+    async def stream_reply():
+        ai_text, pending, is_finished = "", "", False
+        # Turns on one session run one at a time, so a quick reply sent mid-stream can't
+        # interleave with the previous turn in the chat history
+        async with get_chat_lock(session_id):
+            if session_id in finished_sessions:
+                yield sse_event({"reply": "Interview already complete.", "finished": True})
+                return
+            chat = get_chat_session(session_id)
+            try:
+                async for response in await chat.send_message_stream(message):
+                    if not (response.candidates and response.candidates[0].content and response.candidates[0].content.parts): continue
+                    for part in response.candidates[0].content.parts:
+                        if part.function_call:
+                            args = part.function_call.args
+                            score = args.get('score'); feedback = args.get('feedback'); candidate = args.get('candidate_name')
+                            save_result(candidate, score, feedback)
+                            ai_text = f"Interview Complete. Score: {score}/10. {feedback}"; is_finished = True
+                            # Free the finished session right away rather than waiting for the TTL
+                            active_chats.pop(session_id, None)
+                            active_candidates.pop(session_id, None)
+                            finished_sessions[session_id] = True
+                        elif part.text:
+                            ai_text += part.text
+                            *sentences, pending = _SENTENCE_END_RE.split(pending + part.text)
+                            for sentence in sentences:
+                                chunk = sentence.replace("**", "").strip()
+                                if chunk: yield sse_event({"chunk": chunk})
+            except Exception as e:
+                print(f"Chat Error: {e}")
+                return
+
+        if not is_finished:
+            chunk = pending.replace("**", "").strip()
+            if chunk: yield sse_event({"chunk": chunk})
+        reply = ai_text.replace("**", "").strip()
+        log_interaction(session_id, message, reply)
+        if is_finished: flush_session_log(session_id)
+        yield sse_event({"reply": reply, "finished": is_finished})
+
+    return Response(stream_reply(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(port=5001)
\ No newline at end of file
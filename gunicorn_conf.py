@@ -0,0 +1,12 @@
+# gunicorn_conf.py -- run with: gunicorn -c gunicorn_conf.py app:app
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+worker_class = "uvicorn_worker.UvicornWorker"
+# Interview sessions live in process memory, so every request of a session must reach
+# the same worker. Keep 1 worker unless a load balancer pins session_id to a worker;
+# one async worker already serves many interviews at once.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+keepalive = 30
+# Gemini turns and resume parsing can take a while; don't kill workers mid-reply
+timeout = 120